@@ -2,7 +2,9 @@
 HFT RAG Service
 
 Vector-based retrieval for HFT AI Tuner context enhancement.
-Uses ChromaDB for storage and sentence-transformers for embeddings.
+Uses ChromaDB for storage (or a USearch index with RAG_VECTOR_BACKEND=usearch)
+and sentence-transformers for embeddings (INT8 ONNX Runtime by default,
+fp32 PyTorch with RAG_EMBED_BACKEND=torch).
 
 Endpoints:
   GET  /health          - Health check
@@ -14,29 +16,82 @@ Endpoints:
 import os
 import re
 import glob
+import time
+import pickle
+import hashlib
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import accumulate
 from pathlib import Path
-from typing import List, Optional
+from typing import List, Optional, Union
 from datetime import datetime
 
+import numpy as np
+
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 import chromadb
 from chromadb.config import Settings
 from sentence_transformers import SentenceTransformer
 
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
 # Configuration
 PROJECT_ROOT = Path(__file__).parent.parent
 KNOWLEDGE_DIR = PROJECT_ROOT / "knowledge"
 INCLUDE_DIR = PROJECT_ROOT / "include"
 CHROMA_DIR = PROJECT_ROOT / "rag_service" / "chroma_db"
+VECTORS_FILE = CHROMA_DIR / "vecs.fp16.npy"  # row i = embedding of chunk_{i}
+VECTOR_KEYS_FILE = CHROMA_DIR / "vecs.keys.npy"  # row i = content hash of chunk_{i}
+ONNX_DIR = PROJECT_ROOT / "rag_service" / "onnx_model"
 EMBEDDING_MODEL = "all-MiniLM-L6-v2"  # Fast, good quality
+EMBED_BACKEND = os.environ.get("RAG_EMBED_BACKEND", "onnx")  # "onnx" (INT8) or "torch" (fp32)
+EMBED_MAX_LENGTH = 256  # Same truncation as the sentence-transformers model
+VECTOR_BACKEND = os.environ.get("RAG_VECTOR_BACKEND", "chroma")  # "chroma" or "usearch"
+REDIS_URL = os.environ.get("RAG_REDIS_URL")  # shared query cache for multi-worker deploys
+REDIS_TIMEOUT = 0.5  # seconds per Redis operation before the cache is skipped
+REDIS_RETRY_INTERVAL = 5.0  # seconds to bypass Redis after a failure before probing again
 COLLECTION_NAME = "hft_knowledge"
 CHUNK_SIZE = 1000  # characters per chunk
 CHUNK_OVERLAP = 200
+EMBED_BATCH_SIZE = 64
+INDEX_IO_WORKERS = 8  # threads reading knowledge/ and header files during /index
+# chromadb >= 0.5 accepts numpy embeddings; older versions only take lists
+CHROMA_ACCEPTS_NDARRAY = tuple(int(x) for x in chromadb.__version__.split(".")[:2]) >= (0, 5)
+
+# HNSW index parameters. Chroma fixes these at collection creation, so the
+# collection is rebuilt whenever the desired profile changes.
+HNSW_SMALL_PROFILE = {"hnsw:M": 32, "hnsw:construction_ef": 200}   # < 100k chunks, high recall
+HNSW_LARGE_PROFILE = {"hnsw:M": 48, "hnsw:construction_ef": 256}
+HNSW_LARGE_THRESHOLD = 100_000
+HNSW_SEARCH_EF = 64  # /query recall vs latency knob: higher = better recall, slower search
+
+# /query response caching
+QUERY_CACHE_SIZE = 512
+QUERY_CACHE_TTL = 300.0       # seconds
+LSH_BITS = 64                 # random hyperplanes in the semantic cache signature
+SEMANTIC_HIT_THRESHOLD = 0.97  # min cosine similarity to reuse a cached response
+ANN_OVERFETCH = 4             # ANN candidates fetched per returned chunk (widens the HNSW beam)
+
+# Markdown and C++ header patterns
+_PARA_RE = re.compile(r'\n\n+')
+_DOC_RE = re.compile(r'/\*\*[\s\S]*?\*/\s*(class|struct)\s+(\w+)')
+_ENUM_RE = re.compile(r'enum\s+(?:class\s+)?(\w+)\s*\{([^}]+)\}')
+_CFG_RE = re.compile(r'struct\s+(\w*Config\w*)\s*\{([^}]+)\}')
+_HEADER_PATTERNS = (_DOC_RE, _ENUM_RE, _CFG_RE)
+# Fixed-length prefixes that every match of the pattern above begins with
+_HEADER_TRIGGERS = (rb'/\*\*', rb'enum\s', rb'struct\s')
 
 # Initialize FastAPI
-app = FastAPI(title="HFT RAG Service", version="1.0.0")
+app = FastAPI(title="HFT RAG Service", version="1.0.0", default_response_class=ORJSONResponse)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -45,9 +100,12 @@ app.add_middleware(
 )
 
 # Global instances
-embedder: Optional[SentenceTransformer] = None
+embedder: Optional[Union[SentenceTransformer, "OnnxEmbedder"]] = None
 chroma_client: Optional[chromadb.Client] = None
-collection: Optional[chromadb.Collection] = None
+collection: Optional[Union[chromadb.Collection, "UsearchCollection"]] = None
+semantic_cache: Optional["SemanticCache"] = None
+stored_vectors: Optional[np.ndarray] = None  # read-only float16 memmap of VECTORS_FILE
+index_generation = 0  # generation this worker's LRU, memmap and collection handle belong to
 
 
 class QueryRequest(BaseModel):
@@ -69,63 +127,605 @@ class IndexResponse(BaseModel):
     chunks_created: int
 
 
+class OnnxEmbedder:
+    """
+    INT8-quantized ONNX Runtime version of the sentence-transformers model.
+
+    Exports the model on first use, applies dynamic INT8 quantization and
+    caches the result in ONNX_DIR. encode() mirrors the subset of the
+    SentenceTransformer.encode() API used by this service (mean pooling,
+    optional L2 normalization, numpy output).
+    """
+
+    QUANTIZED_FILE = "model_quantized.onnx"
+
+    def __init__(self, model_name: str, cache_dir: Path):
+        from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+        from transformers import AutoTokenizer
+
+        if not (cache_dir / self.QUANTIZED_FILE).exists():
+            model_id = f"sentence-transformers/{model_name}"
+            print(f"[RAG] Exporting {model_id} to ONNX (INT8) at: {cache_dir}")
+            model = ORTModelForFeatureExtraction.from_pretrained(model_id, export=True)
+            model.save_pretrained(cache_dir)
+            AutoTokenizer.from_pretrained(model_id).save_pretrained(cache_dir)
+
+            quantizer = ORTQuantizer.from_pretrained(model)
+            qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+            quantizer.quantize(save_dir=cache_dir, quantization_config=qconfig)
+
+        self.tokenizer = AutoTokenizer.from_pretrained(cache_dir)
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            cache_dir, file_name=self.QUANTIZED_FILE
+        )
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.model.config.hidden_size
+
+    def encode(self, sentences: List[str], batch_size: int = 32,
+               normalize_embeddings: bool = False, **kwargs) -> np.ndarray:
+        """Mean-pooled embeddings as a (len(sentences), dim) float32 array."""
+        batches = []
+        for start in range(0, len(sentences), batch_size):
+            tokens = self.tokenizer(
+                sentences[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=EMBED_MAX_LENGTH,
+                return_tensors="np"
+            )
+            hidden = self.model(**tokens).last_hidden_state
+
+            mask = tokens["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if normalize_embeddings:
+                pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            batches.append(pooled.astype(np.float32, copy=False))
+
+        if not batches:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+        return np.concatenate(batches)
+
+
+class UsearchCollection:
+    """
+    USearch HNSW index exposing the subset of chromadb.Collection used here.
+
+    Vectors are stored as f16 with cosine distance under the integer key of
+    their chunk id (chunk_{i} -> i). Documents and metadata live in a pickled
+    sidecar. Both files are rewritten after every add/delete.
+
+    Upserts and deletes rebuild the graph: HNSW removal only tombstones a
+    node, and re-adding the same keys can leave nodes no search reaches.
+    """
+
+    def __init__(self, directory: Path, ndim: int):
+        self.index_file = directory / "usearch.bin"
+        self.sidecar_file = directory / "usearch_docs.pkl"
+        self.ndim = ndim
+        self.index = self._new_index()
+        self.docs = {}  # key -> (id, document, metadata)
+
+        if self.index_file.exists() and self.sidecar_file.exists():
+            self.index.load(str(self.index_file))
+            with open(self.sidecar_file, "rb") as f:
+                self.docs = pickle.load(f)
+
+    def _new_index(self):
+        from usearch.index import Index
+
+        return Index(
+            ndim=self.ndim,
+            metric="cos",
+            dtype="f16",
+            connectivity=16,
+            expansion_add=64,
+            expansion_search=64
+        )
+
+    @staticmethod
+    def _key(doc_id: str) -> int:
+        return int(doc_id.rsplit("_", 1)[1])
+
+    def _save(self):
+        self.index.save(str(self.index_file))
+        with open(self.sidecar_file, "wb") as f:
+            pickle.dump(self.docs, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _rebuild(self, keys: np.ndarray, vectors: np.ndarray):
+        """Replace the index with a fresh graph over keys, then persist."""
+        index = self._new_index()
+        if len(keys):
+            index.add(keys, vectors)
+        self.index = index
+        self._save()
+
+    def _vectors(self, keys: List[int]) -> np.ndarray:
+        if not keys:
+            return np.empty((0, self.ndim), dtype=np.float32)
+        return np.asarray(self.index.get(np.array(keys, dtype=np.uint64), dtype=np.float32),
+                          dtype=np.float32).reshape(len(keys), self.ndim)
+
+    def count(self) -> int:
+        return len(self.docs)
+
+    def get(self, include: Optional[List[str]] = None) -> dict:
+        return {"ids": [doc_id for doc_id, _, _ in self.docs.values()]}
+
+    def add(self, ids: List[str], embeddings, documents: List[str], metadatas: List[dict]):
+        keys = np.array([self._key(i) for i in ids], dtype=np.uint64)
+        self.index.add(keys, np.asarray(embeddings, dtype=np.float32))
+        for key, doc_id, document, metadata in zip(keys.tolist(), ids, documents, metadatas):
+            self.docs[key] = (doc_id, document, metadata)
+        self._save()
+
+    def upsert(self, ids: List[str], embeddings, documents: List[str], metadatas: List[dict]):
+        keys = [self._key(i) for i in ids]
+        if not any(key in self.docs for key in keys):
+            self.add(ids, embeddings, documents, metadatas)
+            return
+
+        # Keys not being overwritten keep their stored vectors (a full
+        # /index overwrites all of them, so this is usually empty)
+        replaced = set(keys)
+        kept = [key for key in self.docs if key not in replaced]
+        all_keys = np.array(kept + keys, dtype=np.uint64)
+        vectors = np.vstack([self._vectors(kept), np.asarray(embeddings, dtype=np.float32)])
+        for key, doc_id, document, metadata in zip(keys, ids, documents, metadatas):
+            self.docs[key] = (doc_id, document, metadata)
+        self._rebuild(all_keys, vectors)
+
+    def delete(self, ids: List[str]):
+        for doc_id in ids:
+            self.docs.pop(self._key(doc_id), None)
+        kept = list(self.docs)
+        self._rebuild(np.array(kept, dtype=np.uint64), self._vectors(kept))
+
+    def query(self, query_embeddings, n_results: int) -> dict:
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for vector in np.asarray(query_embeddings, dtype=np.float32):
+            matches = self.index.search(vector, n_results)
+            hits = [self.docs[int(key)] for key in matches.keys]
+            results["ids"].append([doc_id for doc_id, _, _ in hits])
+            results["documents"].append([document for _, document, _ in hits])
+            results["metadatas"].append([metadata for _, _, metadata in hits])
+            results["distances"].append(matches.distances.tolist())
+        return results
+
+
+class SemanticCache:
+    """
+    TTL cache of /query responses for near-identical query embeddings.
+
+    Entries are bucketed by a random-projection LSH signature (one bit per
+    hyperplane). A bucket hit is only served if the stored query vector has
+    cosine similarity >= threshold with the new one.
+    """
+
+    def __init__(self, dim: int, n_bits: int = LSH_BITS, max_size: int = QUERY_CACHE_SIZE,
+                 ttl: float = QUERY_CACHE_TTL, threshold: float = SEMANTIC_HIT_THRESHOLD,
+                 seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self.planes = rng.standard_normal((n_bits, dim)).astype(np.float32)
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self.entries: OrderedDict = OrderedDict()  # key -> (embedding, response, expires_at)
+        self.hits = 0
+        self.misses = 0
+        self.index_generation = 0
+
+    def _key(self, embedding: np.ndarray, n_results: int) -> tuple:
+        signature = np.packbits(self.planes @ embedding > 0).tobytes()
+        return signature, n_results
+
+    def _similar(self, stored: np.ndarray, embedding: np.ndarray) -> bool:
+        denom = float(np.linalg.norm(stored) * np.linalg.norm(embedding)) or 1.0
+        return float(stored @ embedding) / denom >= self.threshold
+
+    def get(self, embedding: np.ndarray, n_results: int) -> Optional["QueryResponse"]:
+        response = self._lookup(embedding, n_results)
+        self._record(response is not None)
+        return response
+
+    def _lookup(self, embedding: np.ndarray, n_results: int) -> Optional["QueryResponse"]:
+        key = self._key(embedding, n_results)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        stored, response, expires_at = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            return None
+
+        if not self._similar(stored, embedding):
+            return None
+
+        self.entries.move_to_end(key)
+        return response
+
+    def _record(self, hit: bool):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def put(self, embedding: np.ndarray, n_results: int, response: "QueryResponse"):
+        key = self._key(embedding, n_results)
+        self.entries[key] = (embedding, response, time.monotonic() + self.ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def generation(self) -> int:
+        """Index generation, bumped by every /index (shared across workers with Redis)."""
+        return self.index_generation
+
+    def bump_generation(self) -> int:
+        self.index_generation += 1
+        return self.index_generation
+
+    def stats(self) -> dict:
+        return {"cache_hits": self.hits, "cache_misses": self.misses}
+
+
+class RedisSemanticCache(SemanticCache):
+    """
+    SemanticCache stored in Redis so all uvicorn workers share it.
+
+    Every worker derives the same LSH hyperplanes (fixed seed), so the
+    signature is a stable Redis key. Entries expire through Redis TTLs and
+    the hit/miss counters are shared as well. If Redis is unreachable the
+    cache degrades to misses and no-ops instead of failing requests, and
+    is bypassed entirely for REDIS_RETRY_INTERVAL after each failure.
+    """
+
+    KEY_PREFIX = "rag:query:"
+    STATS_PREFIX = "rag:stats:"
+    GENERATION_KEY = "rag:generation"
+
+    def __init__(self, dim: int, url: str, **kwargs):
+        import redis
+
+        super().__init__(dim, **kwargs)
+        # Short timeouts: an unreachable Redis must not stall /query
+        self.redis = redis.Redis.from_url(url, socket_connect_timeout=REDIS_TIMEOUT,
+                                          socket_timeout=REDIS_TIMEOUT)
+        self.redis_errors = redis.RedisError
+        self.available = True
+        self.retry_at = 0.0  # monotonic time before which Redis is not tried
+
+    def _usable(self) -> bool:
+        # A blackholed host costs REDIS_TIMEOUT per call, so don't probe it
+        # on every request while it is down
+        return self.available or time.monotonic() >= self.retry_at
+
+    def _failed(self, e: Exception):
+        # Log once per outage rather than once per request
+        if self.available:
+            print(f"[RAG] Redis cache unavailable ({e}), serving without it")
+        self.available = False
+        self.retry_at = time.monotonic() + REDIS_RETRY_INTERVAL
+
+    def _recovered(self):
+        if not self.available:
+            print("[RAG] Redis cache reconnected")
+        self.available = True
+
+    def _redis_key(self, embedding: np.ndarray, n_results: int) -> str:
+        # Scoped by generation: entries from before a reindex are never served,
+        # even if clear() could not reach Redis
+        signature, n_results = self._key(embedding, n_results)
+        return f"{self.KEY_PREFIX}{self.index_generation}:{signature.hex()}:{n_results}"
+
+    def _lookup(self, embedding: np.ndarray, n_results: int) -> Optional["QueryResponse"]:
+        if not self._usable():
+            return None
+        try:
+            stored, payload = self.redis.hmget(self._redis_key(embedding, n_results),
+                                               "embedding", "response")
+        except self.redis_errors as e:
+            self._failed(e)
+            return None
+        self._recovered()
+        if stored is None or payload is None:
+            return None
+        if not self._similar(np.frombuffer(stored, dtype=np.float32), embedding):
+            return None
+        return QueryResponse.model_validate_json(payload)
+
+    def _record(self, hit: bool):
+        if not self._usable():
+            return
+        try:
+            self.redis.incr(self.STATS_PREFIX + ("hits" if hit else "misses"))
+        except self.redis_errors as e:
+            self._failed(e)
+
+    def put(self, embedding: np.ndarray, n_results: int, response: "QueryResponse"):
+        if not self._usable():
+            return
+        key = self._redis_key(embedding, n_results)
+        try:
+            with self.redis.pipeline() as pipe:
+                pipe.hset(key, mapping={
+                    "embedding": embedding.astype(np.float32, copy=False).tobytes(),
+                    "response": response.model_dump_json(),
+                })
+                pipe.expire(key, int(self.ttl))
+                pipe.execute()
+        except self.redis_errors as e:
+            self._failed(e)
+
+    def clear(self):
+        # Skipped entries are unreachable anyway: keys are scoped by generation
+        if not self._usable():
+            return
+        try:
+            keys = list(self.redis.scan_iter(f"{self.KEY_PREFIX}*"))
+            if keys:
+                self.redis.delete(*keys)
+        except self.redis_errors as e:
+            self._failed(e)
+
+    def generation(self) -> int:
+        # On failure keep the last known generation rather than flushing state
+        if not self._usable():
+            return self.index_generation
+        try:
+            self.index_generation = int(self.redis.get(self.GENERATION_KEY) or 0)
+        except self.redis_errors as e:
+            self._failed(e)
+        else:
+            self._recovered()
+        return self.index_generation
+
+    def bump_generation(self) -> int:
+        if self._usable():
+            try:
+                self.index_generation = int(self.redis.incr(self.GENERATION_KEY))
+                return self.index_generation
+            except self.redis_errors as e:
+                self._failed(e)
+        # Other workers won't see this reindex until Redis is back
+        self.index_generation += 1
+        return self.index_generation
+
+    def stats(self) -> dict:
+        if not self._usable():
+            return {"cache_hits": None, "cache_misses": None, "cache_available": False}
+        try:
+            hits, misses = self.redis.mget(self.STATS_PREFIX + "hits", self.STATS_PREFIX + "misses")
+        except self.redis_errors as e:
+            self._failed(e)
+            return {"cache_hits": None, "cache_misses": None, "cache_available": False}
+        return {"cache_hits": int(hits or 0), "cache_misses": int(misses or 0)}
+
+
+def _load_semantic_cache(dim: int) -> SemanticCache:
+    """Redis-backed cache when RAG_REDIS_URL is set, in-process otherwise."""
+    if REDIS_URL:
+        try:
+            print(f"[RAG] Using Redis query cache at: {REDIS_URL}")
+            return RedisSemanticCache(dim, REDIS_URL)
+        except ImportError as e:
+            print(f"[RAG] Redis cache unavailable ({e}), using in-process cache")
+    return SemanticCache(dim)
+
+
+def _detect_device() -> str:
+    """Pick the fastest available torch device: CUDA, then MPS, then CPU."""
+    try:
+        import torch
+    except ImportError:
+        return "cpu"
+
+    if torch.cuda.is_available():
+        return "cuda"
+    mps = getattr(torch.backends, "mps", None)
+    if mps is not None and mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+def _load_embedder() -> Union[SentenceTransformer, OnnxEmbedder]:
+    """Load the embedder selected by RAG_EMBED_BACKEND, falling back to torch."""
+    if EMBED_BACKEND == "onnx":
+        try:
+            print(f"[RAG] Loading embedding model: {EMBEDDING_MODEL} (onnx int8)")
+            return OnnxEmbedder(EMBEDDING_MODEL, ONNX_DIR)
+        except ImportError as e:
+            print(f"[RAG] ONNX backend unavailable ({e}), falling back to torch")
+
+    device = _detect_device()
+    print(f"[RAG] Loading embedding model: {EMBEDDING_MODEL} (device: {device})")
+    return SentenceTransformer(EMBEDDING_MODEL, device=device)
+
+
 def init_components():
     """Initialize embedding model and ChromaDB."""
-    global embedder, chroma_client, collection
+    global embedder, chroma_client, collection, semantic_cache, stored_vectors, index_generation
 
-    print(f"[RAG] Loading embedding model: {EMBEDDING_MODEL}")
-    embedder = SentenceTransformer(EMBEDDING_MODEL)
+    embedder = _load_embedder()
+    semantic_cache = _load_semantic_cache(embedder.get_sentence_embedding_dimension())
+    index_generation = semantic_cache.generation()
 
-    print(f"[RAG] Initializing ChromaDB at: {CHROMA_DIR}")
     CHROMA_DIR.mkdir(parents=True, exist_ok=True)
-    chroma_client = chromadb.PersistentClient(path=str(CHROMA_DIR))
+    stored_vectors = load_vectors()
 
-    # Get or create collection
-    collection = chroma_client.get_or_create_collection(
-        name=COLLECTION_NAME,
-        metadata={"description": "HFT trading knowledge base"}
-    )
+    if VECTOR_BACKEND == "usearch":
+        try:
+            print(f"[RAG] Initializing USearch index at: {CHROMA_DIR}")
+            collection = UsearchCollection(CHROMA_DIR, embedder.get_sentence_embedding_dimension())
+        except ImportError as e:
+            print(f"[RAG] USearch backend unavailable ({e}), falling back to ChromaDB")
+
+    if collection is None:
+        print(f"[RAG] Initializing ChromaDB at: {CHROMA_DIR}")
+        chroma_client = chromadb.PersistentClient(path=str(CHROMA_DIR))
+
+        # Opened without metadata so the stored HNSW profile is what gets checked
+        collection = chroma_client.get_or_create_collection(name=COLLECTION_NAME)
+        ensure_collection_profile(collection.count())
     print(f"[RAG] Collection '{COLLECTION_NAME}' ready with {collection.count()} documents")
 
+    warmup()
+
+
+def warmup():
+    """
+    Run the embedder once so the first /query doesn't pay for graph/session
+    initialization (~hundreds of ms, moved to startup).
+    """
+    print("[RAG] Warming up embedder...")
+    embedder.encode(["warmup"] * 8, convert_to_numpy=True)
+    if str(getattr(embedder, "device", "cpu")).startswith("cuda"):
+        import torch
+        torch.cuda.synchronize()
+
+
+def collection_metadata(n_chunks: int = 0) -> dict:
+    """Collection metadata with the HNSW profile for a corpus of n_chunks."""
+    profile = HNSW_LARGE_PROFILE if n_chunks > HNSW_LARGE_THRESHOLD else HNSW_SMALL_PROFILE
+    return {
+        "description": "HFT trading knowledge base",
+        "hnsw:space": "cosine",
+        **profile,
+        "hnsw:search_ef": HNSW_SEARCH_EF,
+        "hnsw:batch_size": 100,
+    }
+
+
+def ensure_collection_profile(n_chunks: int):
+    """Recreate the (then empty) collection if its HNSW parameters are stale."""
+    global collection
+
+    if chroma_client is None:
+        return  # USearch backend: parameters are fixed in UsearchCollection
+
+    metadata = collection_metadata(n_chunks)
+    if collection.metadata == metadata:
+        return
+
+    print(f"[RAG] HNSW parameters changed, recreating collection '{COLLECTION_NAME}'")
+    chroma_client.delete_collection(COLLECTION_NAME)
+    collection = chroma_client.create_collection(name=COLLECTION_NAME, metadata=metadata)
+
 
 def chunk_text(text: str, source: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[dict]:
     """Split text into overlapping chunks."""
     chunks = []
 
-    # Split by paragraphs first, then by size
-    paragraphs = re.split(r'\n\n+', text)
-    current_chunk = ""
-
-    for para in paragraphs:
-        if len(current_chunk) + len(para) < chunk_size:
-            current_chunk += para + "\n\n"
-        else:
-            if current_chunk:
-                chunks.append({
-                    "text": current_chunk.strip(),
-                    "source": source,
-                    "type": "documentation"
-                })
-            current_chunk = para + "\n\n"
+    # Split by paragraphs first, then by size. offsets[k] is the length of
+    # paragraphs[:k] joined with "\n\n" separators (plus a trailing one).
+    paragraphs = _PARA_RE.split(text)
+    offsets = [0, *accumulate(len(p) + 2 for p in paragraphs)]
 
-    if current_chunk:
+    # A chunk keeps taking paragraphs while its length stays below
+    # chunk_size; it always takes at least one paragraph.
+    start = 0
+    while start < len(paragraphs):
+        limit = offsets[start] + chunk_size + 2
+        end = bisect_left(offsets, limit, start + 2) - 1
         chunks.append({
-            "text": current_chunk.strip(),
+            "text": "\n\n".join(paragraphs[start:end]).strip(),
             "source": source,
             "type": "documentation"
         })
+        start = end
 
     return chunks
 
 
+def _compile_header_db():
+    """Compile the header pattern triggers into one Hyperscan database (None if unavailable)."""
+    if hyperscan is None:
+        return None
+
+    flags = hyperscan.HS_FLAG_SOM_LEFTMOST | hyperscan.HS_FLAG_UTF8 | hyperscan.HS_FLAG_UCP
+    db = hyperscan.Database()
+    try:
+        db.compile(
+            expressions=list(_HEADER_TRIGGERS),
+            ids=list(range(len(_HEADER_TRIGGERS))),
+            elements=len(_HEADER_TRIGGERS),
+            flags=[flags] * len(_HEADER_TRIGGERS)
+        )
+    except hyperscan.error as e:
+        print(f"[RAG] Hyperscan compile failed ({e}), using Python regex only")
+        return None
+    return db
+
+
+_HEADER_DB = _compile_header_db()
+_scratch = threading.local()  # hyperscan.Scratch is per-thread; /index scans in a pool
+
+
+def _header_match_starts(content: str) -> List[Optional[List[int]]]:
+    """
+    Sorted candidate offsets for each header pattern, or None (try everywhere)
+    without Hyperscan.
+
+    One Hyperscan pass finds every occurrence of each pattern's trigger, a
+    fixed-length prefix all of its matches start with. Triggers are used
+    rather than the full patterns because Hyperscan only reports the leftmost
+    start per match end, which can hide a later match (e.g. a second doc
+    block ending at the same class name).
+    """
+    if _HEADER_DB is None:
+        return [None] * len(_HEADER_PATTERNS)
+
+    scratch = getattr(_scratch, "value", None)
+    if scratch is None:
+        scratch = _scratch.value = hyperscan.Scratch(_HEADER_DB)
+
+    data = content.encode('utf-8')
+    found = [set() for _ in _HEADER_PATTERNS]
+
+    def on_match(pattern_id, start, end, flags, context):
+        found[pattern_id].add(start)
+
+    _HEADER_DB.scan(data, match_event_handler=on_match, scratch=scratch)
+
+    # Byte offsets -> str offsets (triggers start on an ASCII character)
+    if content.isascii():
+        return [sorted(starts) for starts in found]
+    to_str, pos, prev = {}, 0, 0
+    for off in sorted(set().union(*found)):
+        pos += len(data[prev:off].decode('utf-8'))
+        to_str[off], prev = pos, off
+    return [sorted(to_str[off] for off in starts) for starts in found]
+
+
+def _finditer(pattern: re.Pattern, content: str, starts: Optional[List[int]]):
+    """pattern.finditer(content), trying only the candidate starts when given."""
+    if starts is None:
+        yield from pattern.finditer(content)
+        return
+
+    end = 0
+    for start in starts:
+        if start < end:
+            continue  # inside the previous match, as finditer would skip it
+        match = pattern.match(content, start)
+        if match:
+            yield match
+            end = match.end()
+
+
 def extract_code_docs(file_path: Path) -> List[dict]:
     """Extract documentation and key code from C++ headers."""
     chunks = []
     content = file_path.read_text(encoding='utf-8', errors='ignore')
+    doc_starts, enum_starts, config_starts = _header_match_starts(content)
 
     # Extract class/struct documentation
-    doc_pattern = r'/\*\*[\s\S]*?\*/\s*(class|struct)\s+(\w+)'
-    for match in re.finditer(doc_pattern, content):
+    for match in _finditer(_DOC_RE, content, doc_starts):
         doc_block = match.group(0)
         class_name = match.group(2)
         chunks.append({
@@ -135,8 +735,7 @@ def extract_code_docs(file_path: Path) -> List[dict]:
         })
 
     # Extract enum definitions (useful for regimes, signals)
-    enum_pattern = r'enum\s+(?:class\s+)?(\w+)\s*\{([^}]+)\}'
-    for match in re.finditer(enum_pattern, content):
+    for match in _finditer(_ENUM_RE, content, enum_starts):
         enum_name = match.group(1)
         enum_body = match.group(2)
         chunks.append({
@@ -146,8 +745,7 @@ def extract_code_docs(file_path: Path) -> List[dict]:
         })
 
     # Extract struct configs (important for parameters)
-    config_pattern = r'struct\s+(\w*Config\w*)\s*\{([^}]+)\}'
-    for match in re.finditer(config_pattern, content):
+    for match in _finditer(_CFG_RE, content, config_starts):
         config_name = match.group(1)
         config_body = match.group(2)
         chunks.append({
@@ -159,17 +757,127 @@ def extract_code_docs(file_path: Path) -> List[dict]:
     return chunks
 
 
+def embed_texts(texts: List[str]):
+    """
+    Encode texts in length-sorted batches.
+
+    Sorting by length keeps similarly sized chunks in the same batch so the
+    tokenizer pads each batch to a near-uniform length. Rows are returned
+    in the original order.
+    """
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    inverse = [0] * len(order)
+    for k, i in enumerate(order):
+        inverse[i] = k
+
+    embeddings = embedder.encode(
+        [texts[i] for i in order],
+        batch_size=EMBED_BATCH_SIZE,
+        convert_to_numpy=True,
+        show_progress_bar=False,
+        normalize_embeddings=True
+    ).astype(np.float32, copy=False)
+    return embeddings[inverse]
+
+
+def chroma_embeddings(embeddings: np.ndarray):
+    """Embeddings in the form the installed chromadb accepts."""
+    return embeddings if CHROMA_ACCEPTS_NDARRAY else embeddings.tolist()
+
+
+def save_vectors(embeddings: np.ndarray, keys: List[bytes]):
+    """
+    Write embeddings to VECTORS_FILE as a float16 table, with their content
+    hashes in VECTOR_KEYS_FILE.
+
+    Chroma keeps its own fp32 copy; this half-width table serves custom
+    search paths and the reindex embedding cache. Written to temp files and
+    renamed so readers holding the previous memmap are unaffected.
+    """
+    tmp_file = VECTORS_FILE.with_suffix(".tmp.npy")
+    table = np.lib.format.open_memmap(tmp_file, mode="w+", dtype=np.float16, shape=embeddings.shape)
+    table[:] = embeddings
+    table.flush()
+    del table
+
+    tmp_keys = VECTOR_KEYS_FILE.with_suffix(".tmp.npy")
+    np.save(tmp_keys, np.frombuffer(b"".join(keys), dtype=np.uint8).reshape(len(keys), -1))
+
+    os.replace(tmp_file, VECTORS_FILE)
+    os.replace(tmp_keys, VECTOR_KEYS_FILE)
+
+
+def load_vectors() -> Optional[np.ndarray]:
+    """Memory-map the float16 embeddings table, if one has been written."""
+    if not VECTORS_FILE.exists():
+        return None
+    return np.load(VECTORS_FILE, mmap_mode="r")
+
+
+def content_key(text: str) -> bytes:
+    """Cache key for a chunk's embedding: model, backend and chunk text."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{EMBEDDING_MODEL}:{type(embedder).__name__}\0".encode())
+    h.update(text.encode("utf-8"))
+    return h.digest()
+
+
+def embed_with_cache(texts: List[str], keys: List[bytes]) -> np.ndarray:
+    """
+    Embeddings for texts, encoding only chunks not present in the last index.
+
+    Unchanged chunks are looked up by content hash in the float16 table
+    written by the previous index run.
+    """
+    cached_rows = {}
+    if stored_vectors is not None and VECTOR_KEYS_FILE.exists():
+        stored_keys = np.load(VECTOR_KEYS_FILE)
+        if len(stored_keys) == len(stored_vectors):
+            cached_rows = {row.tobytes(): r for r, row in enumerate(stored_keys)}
+
+    hits = [(i, cached_rows[k]) for i, k in enumerate(keys) if k in cached_rows]
+    misses = [i for i, k in enumerate(keys) if k not in cached_rows]
+    print(f"[RAG] Embedding cache: {len(hits)} hits, {len(misses)} misses")
+
+    embeddings = np.empty((len(texts), embedder.get_sentence_embedding_dimension()), dtype=np.float32)
+    if hits:
+        positions, rows = zip(*hits)
+        embeddings[list(positions)] = stored_vectors[list(rows)]
+    if misses:
+        embeddings[misses] = embed_texts([texts[i] for i in misses])
+    return embeddings
+
+
+def sync_index_generation():
+    """
+    Drop this worker's per-process state if another worker has reindexed:
+    the exact-match LRU, the float16 memmap and the vector store handle.
+    """
+    global stored_vectors, chroma_client, collection, index_generation
+
+    generation = semantic_cache.generation()
+    if generation == index_generation:
+        return
+    print(f"[RAG] Index generation {index_generation} -> {generation}, reloading")
+    index_generation = generation
+    run_query.cache_clear()
+    stored_vectors = load_vectors()
+    if isinstance(collection, UsearchCollection):
+        collection = UsearchCollection(CHROMA_DIR, embedder.get_sentence_embedding_dimension())
+    elif chroma_client is not None:
+        # A PersistentClient keeps the HNSW segment it loaded and never sees
+        # other processes' writes (the collection may even have been
+        # recreated), so reopen it from disk. Clients are cached per path.
+        chroma_client.clear_system_cache()
+        chroma_client = chromadb.PersistentClient(path=str(CHROMA_DIR))
+        collection = chroma_client.get_collection(COLLECTION_NAME)
+
+
 def index_documents() -> IndexResponse:
     """Index all documents from knowledge/ and include/."""
+    global stored_vectors, index_generation
     all_chunks = []
 
-    # Index markdown documentation
-    for md_file in KNOWLEDGE_DIR.glob("**/*.md"):
-        print(f"[RAG] Indexing: {md_file}")
-        content = md_file.read_text(encoding='utf-8')
-        chunks = chunk_text(content, str(md_file.relative_to(PROJECT_ROOT)))
-        all_chunks.extend(chunks)
-
     # Index key C++ headers
     key_headers = [
         "include/strategy/regime_detector.hpp",
@@ -179,36 +887,61 @@ def index_documents() -> IndexResponse:
         "include/ipc/symbol_config.hpp",
         "include/risk/enhanced_risk_manager.hpp",
     ]
+    header_paths = [PROJECT_ROOT / h for h in key_headers if (PROJECT_ROOT / h).exists()]
 
-    for header in key_headers:
-        header_path = PROJECT_ROOT / header
-        if header_path.exists():
-            print(f"[RAG] Extracting code docs from: {header}")
-            chunks = extract_code_docs(header_path)
+    # File reads (and header regex scans) overlap in a thread pool;
+    # results keep the sequential order
+    with ThreadPoolExecutor(max_workers=INDEX_IO_WORKERS) as pool:
+        md_files = list(KNOWLEDGE_DIR.glob("**/*.md"))
+        md_contents = pool.map(lambda p: p.read_text(encoding='utf-8'), md_files)
+        header_chunks = pool.map(extract_code_docs, header_paths)
+
+        # Index markdown documentation
+        for md_file, content in zip(md_files, md_contents):
+            print(f"[RAG] Indexing: {md_file}")
+            chunks = chunk_text(content, str(md_file.relative_to(PROJECT_ROOT)))
+            all_chunks.extend(chunks)
+
+        for header_path, chunks in zip(header_paths, header_chunks):
+            print(f"[RAG] Extracting code docs from: {header_path.relative_to(PROJECT_ROOT)}")
             all_chunks.extend(chunks)
 
-    # Clear existing collection and add new documents
-    if collection.count() > 0:
-        # Delete all existing
-        all_ids = collection.get()["ids"]
-        if all_ids:
-            collection.delete(ids=all_ids)
+    ensure_collection_profile(len(all_chunks))
+    ids = [f"chunk_{i}" for i in range(len(all_chunks))]
 
-    # Add chunks to collection
+    # Drop chunks beyond the new corpus; the rest are overwritten below
+    current_ids = set(ids)
+    stale_ids = [i for i in collection.get(include=[])["ids"] if i not in current_ids]
+    if stale_ids:
+        collection.delete(ids=stale_ids)
+
+    # Upsert chunks into the collection
     if all_chunks:
-        ids = [f"chunk_{i}" for i in range(len(all_chunks))]
         texts = [c["text"] for c in all_chunks]
         metadatas = [{"source": c["source"], "type": c["type"]} for c in all_chunks]
+        keys = [content_key(t) for t in texts]
 
         print(f"[RAG] Creating embeddings for {len(texts)} chunks...")
-        embeddings = embedder.encode(texts).tolist()
+        embeddings = embed_with_cache(texts, keys)
 
-        collection.add(
+        collection.upsert(
             ids=ids,
-            embeddings=embeddings,
+            embeddings=chroma_embeddings(embeddings),
             documents=texts,
             metadatas=metadatas
         )
+        save_vectors(embeddings, keys)
+    else:
+        for path in (VECTORS_FILE, VECTOR_KEYS_FILE):
+            if path.exists():
+                path.unlink()
+    stored_vectors = load_vectors()
+
+    # Cached responses refer to the previous index; the new generation tells
+    # the other workers to drop theirs
+    index_generation = semantic_cache.bump_generation()
+    run_query.cache_clear()
+    semantic_cache.clear()
 
     return IndexResponse(
         status="success",
@@ -242,33 +975,55 @@ async def query(request: QueryRequest):
     if not collection or collection.count() == 0:
         raise HTTPException(status_code=503, detail="Knowledge base not indexed")
 
+    sync_index_generation()
+    return run_query(request.query, request.regime, request.symbol, request.n_results)
+
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def run_query(query: str, regime: Optional[str], symbol: Optional[str],
+              n_results: int) -> QueryResponse:
+    """
+    Embed the query and search the collection.
+
+    Exact repeats are served by the LRU cache without touching the embedder;
+    near-identical queries are served by the semantic cache without a search.
+    """
     # Build enhanced query with context
-    query_text = request.query
-    if request.regime:
-        query_text += f" market regime: {request.regime}"
-    if request.symbol:
-        query_text += f" symbol: {request.symbol}"
+    query_text = query
+    if regime:
+        query_text += f" market regime: {regime}"
+    if symbol:
+        query_text += f" symbol: {symbol}"
 
     # Create query embedding
-    query_embedding = embedder.encode([query_text]).tolist()[0]
+    query_embedding = embedder.encode(
+        [query_text], convert_to_numpy=True, normalize_embeddings=True
+    )[0].astype(np.float32, copy=False)
+
+    cached = semantic_cache.get(query_embedding, n_results)
+    if cached is not None:
+        return cached
 
-    # Search
+    # Search: results come back sorted by cosine distance; over-fetching
+    # only raises the effective search ef, so keep the first n_results
     results = collection.query(
-        query_embeddings=[query_embedding],
-        n_results=request.n_results
+        query_embeddings=chroma_embeddings(query_embedding[None, :]),
+        n_results=n_results * ANN_OVERFETCH
     )
 
     # Build context
-    chunks = results["documents"][0] if results["documents"] else []
-    sources = [m["source"] for m in results["metadatas"][0]] if results["metadatas"] else []
+    chunks = results["documents"][0][:n_results] if results["documents"] else []
+    sources = [m["source"] for m in results["metadatas"][0][:n_results]] if results["metadatas"] else []
 
     context = "\n\n---\n\n".join(chunks)
 
-    return QueryResponse(
+    response = QueryResponse(
         context=context,
         sources=list(set(sources)),
         n_chunks=len(chunks)
     )
+    semantic_cache.put(query_embedding, n_results, response)
+    return response
 
 
 @app.post("/index", response_model=IndexResponse)
@@ -285,7 +1040,9 @@ async def stats():
         "total_chunks": collection.count() if collection else 0,
         "embedding_model": EMBEDDING_MODEL,
         "knowledge_dir": str(KNOWLEDGE_DIR),
-        "indexed_at": datetime.now().isoformat()
+        "indexed_at": datetime.now().isoformat(),
+        **(semantic_cache.stats() if semantic_cache else {}),
+        "exact_cache_hits": run_query.cache_info().hits,
     }
 
 
@@ -8,7 +8,8 @@ Uses the strategy parameters optimized from backtesting:
 - Max position: 0.1 BTC
 
 Requirements:
-    pip install python-binance
+    pip install python-binance numpy
+    pip install numba  # optional, JIT-compiles the position kernels
 
 Setup:
     1. Go to https://testnet.binance.vision/
@@ -21,21 +22,32 @@ Setup:
 
 import os
 import sys
-import time
+import asyncio
 import logging
 from decimal import Decimal, ROUND_DOWN
 from dataclasses import dataclass
-from typing import Optional
+from typing import Optional, Sequence, Tuple, Union
 import signal
 
+import numpy as np
+
 # Check for binance library
 try:
-    from binance.client import Client
+    from binance import AsyncClient, BinanceSocketManager
     from binance.exceptions import BinanceAPIException
 except ImportError:
     print("Please install python-binance: pip install python-binance")
     sys.exit(1)
 
+# Numba is optional: without it the position kernels run as plain Python
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -53,11 +65,46 @@ class StrategyConfig:
     quote_size: float = 0.001     # 0.001 BTC per quote (testnet)
     max_position: float = 0.01    # Max 0.01 BTC position
     skew_factor: float = 0.5      # Inventory skew
-    update_interval: float = 5.0  # Seconds between quote updates
+    min_requote_interval: float = 0.5  # Min seconds between requotes (rate limit)
     price_decimals: int = 2       # BTC price decimals
     qty_decimals: int = 5         # BTC quantity decimals
 
 
+@njit(cache=True)
+def _on_fill_kernel(quantity: float, avg_price: float, realized_pnl: float,
+                    is_buy: bool, qty: float, price: float):
+    """
+    Apply a fill; returns the new (quantity, avg_price, realized_pnl).
+
+    Straight-line version of the add/cover/flip cases: fill direction under
+    market making alternates, so branching on it mispredicts constantly.
+    """
+    sign = 2.0 * is_buy - 1.0
+
+    # Part of the fill that reduces an opposite position (covering short /
+    # closing long); the rest adds to (or opens) a position in `sign` direction
+    cover = min(qty, max(0.0, -sign * quantity))
+    add = qty - cover
+    realized_pnl += cover * (avg_price - price) * sign
+
+    # Volume-weighted entry over what remains of the old position plus the
+    # added part. When the fill leaves us flat, avg_price is kept unchanged.
+    held = abs(quantity) - cover
+    quantity += sign * qty
+    new_abs = abs(quantity)
+    flat = float(new_abs == 0.0)
+    avg_price = (held * avg_price + add * price + flat * avg_price) / (new_abs + flat)
+
+    return quantity, avg_price, realized_pnl
+
+
+@njit(cache=True)
+def _unrealized_pnl_kernel(quantity: float, avg_price: float, current_price: float) -> float:
+    if quantity == 0:
+        return 0.0
+    return quantity * (current_price - avg_price)
+
+
 @dataclass
 class Position:
     """Current position and P&L tracking"""
@@ -69,78 +116,80 @@ class Position:
     def on_fill(self, side: str, qty: float, price: float):
         """Update position on fill"""
         self.total_trades += 1
-
-        if side == "BUY":
-            if self.quantity >= 0:
-                # Adding to long
-                total_cost = self.quantity * self.avg_price + qty * price
-                self.quantity += qty
-                self.avg_price = total_cost / self.quantity if self.quantity > 0 else 0
-            else:
-                # Covering short
-                cover = min(qty, -self.quantity)
-                self.realized_pnl += cover * (self.avg_price - price)
-                self.quantity += qty
-                if self.quantity > 0:
-                    self.avg_price = price
-        else:  # SELL
-            if self.quantity <= 0:
-                # Adding to short
-                total_cost = abs(self.quantity) * self.avg_price + qty * price
-                self.quantity -= qty
-                self.avg_price = total_cost / abs(self.quantity) if self.quantity != 0 else 0
-            else:
-                # Closing long
-                close = min(qty, self.quantity)
-                self.realized_pnl += close * (price - self.avg_price)
-                self.quantity -= qty
-                if self.quantity < 0:
-                    self.avg_price = price
+        self.quantity, self.avg_price, self.realized_pnl = _on_fill_kernel(
+            self.quantity, self.avg_price, self.realized_pnl,
+            side == "BUY", float(qty), float(price)
+        )
 
     def unrealized_pnl(self, current_price: float) -> float:
         """Calculate unrealized P&L at current price"""
-        if self.quantity == 0:
-            return 0
-        return self.quantity * (current_price - self.avg_price)
+        return _unrealized_pnl_kernel(self.quantity, self.avg_price, float(current_price))
 
     def total_pnl(self, current_price: float) -> float:
         return self.realized_pnl + self.unrealized_pnl(current_price)
 
 
 class MarketMaker:
-    """Simple market making strategy"""
-
-    def __init__(self, config: StrategyConfig):
-        self.config = config
-
-    def calculate_quotes(self, mid_price: float, position: float) -> tuple:
+    """
+    Simple market making strategy
+
+    Parameters are held as arrays along a symbol axis so quotes for any
+    number of symbols are computed in one vectorized pass.
+    """
+
+    def __init__(self, configs: Union[StrategyConfig, Sequence[StrategyConfig]]):
+        if isinstance(configs, StrategyConfig):
+            configs = [configs]
+        self.configs = list(configs)
+        self.config = self.configs[0]
+
+        # Per-symbol parameters (SoA)
+        self.spread_bps = np.array([c.spread_bps for c in self.configs], dtype=np.float64)
+        self.max_position = np.array([c.max_position for c in self.configs], dtype=np.float64)
+        self.quote_size = np.array([c.quote_size for c in self.configs], dtype=np.float64)
+        self.skew_factor = np.array([c.skew_factor for c in self.configs], dtype=np.float64)
+
+        # Per-symbol tick/step quantizers for wire formatting
+        self._pq = [Decimal(1).scaleb(-c.price_decimals) for c in self.configs]
+        self._qq = [Decimal(1).scaleb(-c.qty_decimals) for c in self.configs]
+
+    def fmt_price(self, price: float, i: int = 0) -> str:
+        """Price string for symbol i truncated to its price tick (never rounds up)"""
+        return format(Decimal(repr(float(price))).quantize(self._pq[i], rounding=ROUND_DOWN), 'f')
+
+    def fmt_qty(self, quantity: float, i: int = 0) -> str:
+        """Quantity string for symbol i truncated to its lot step (never rounds up)"""
+        return format(Decimal(repr(float(quantity))).quantize(self._qq[i], rounding=ROUND_DOWN), 'f')
+
+    def calculate_quotes(self, mid: np.ndarray, position: np.ndarray
+                         ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
         """
-        Calculate bid/ask prices based on mid price and current position.
+        Calculate bid/ask prices based on mid prices and current positions.
+        Arrays are aligned with the configured symbols (1-element for one symbol).
         Returns (bid_price, ask_price, bid_size, ask_size)
         """
         # Calculate half spread
-        half_spread = mid_price * (self.config.spread_bps / 2) / 10000
+        half_spread = mid * self.spread_bps / 20000.0
 
-        # Calculate inventory skew
-        position_ratio = position / self.config.max_position if self.config.max_position > 0 else 0
-        skew = half_spread * position_ratio * self.config.skew_factor
+        # Calculate inventory skew (no skew where max_position is 0)
+        position_ratio = np.divide(position, self.max_position,
+                                   out=np.zeros_like(half_spread),
+                                   where=self.max_position > 0)
+        skew = half_spread * position_ratio * self.skew_factor
 
         # Calculate prices
-        bid_price = mid_price - half_spread - skew
-        ask_price = mid_price + half_spread - skew
+        bid_price = mid - half_spread - skew
+        ask_price = mid + half_spread - skew
 
         # Calculate sizes based on position limits
-        room_to_buy = self.config.max_position - position
-        room_to_sell = self.config.max_position + position
-
-        bid_size = min(self.config.quote_size, max(0, room_to_buy))
-        ask_size = min(self.config.quote_size, max(0, room_to_sell))
+        bid_size = np.minimum(self.quote_size, np.maximum(0.0, self.max_position - position))
+        ask_size = np.minimum(self.quote_size, np.maximum(0.0, self.max_position + position))
 
         return bid_price, ask_price, bid_size, ask_size
 
 
 class BinanceTestnetBot:
-    """Main trading bot"""
+    """Main trading bot (event-driven over Binance WebSocket streams)"""
 
     def __init__(self, config: StrategyConfig):
         self.config = config
@@ -152,38 +201,42 @@ class BinanceTestnetBot:
         self.bid_order_id: Optional[int] = None
         self.ask_order_id: Optional[int] = None
 
-        # Initialize Binance client
-        api_key = os.environ.get("BINANCE_TESTNET_API_KEY")
-        api_secret = os.environ.get("BINANCE_TESTNET_API_SECRET")
+        # Latest mid price from the book ticker stream
+        self.mid_price: Optional[float] = None
+        self._tick = asyncio.Event()
+        self._stopped = asyncio.Event()
 
-        if not api_key or not api_secret:
+        # Binance credentials (client is created in connect())
+        self.api_key = os.environ.get("BINANCE_TESTNET_API_KEY")
+        self.api_secret = os.environ.get("BINANCE_TESTNET_API_SECRET")
+
+        if not self.api_key or not self.api_secret:
             raise ValueError(
                 "Please set BINANCE_TESTNET_API_KEY and BINANCE_TESTNET_API_SECRET "
                 "environment variables"
             )
 
-        self.client = Client(
-            api_key,
-            api_secret,
+        self.client: Optional[AsyncClient] = None
+        self.bsm: Optional[BinanceSocketManager] = None
+
+    async def connect(self):
+        """Create the async REST client and socket manager"""
+        self.client = await AsyncClient.create(
+            self.api_key,
+            self.api_secret,
             testnet=True
         )
+        self.bsm = BinanceSocketManager(self.client)
 
         logger.info(f"Connected to Binance Testnet")
-        logger.info(f"Symbol: {config.symbol}")
-        logger.info(f"Spread: {config.spread_bps} bps")
-        logger.info(f"Quote size: {config.quote_size}")
-        logger.info(f"Max position: {config.max_position}")
-
-    def get_mid_price(self) -> float:
-        """Get current mid price from order book"""
-        ticker = self.client.get_orderbook_ticker(symbol=self.config.symbol)
-        bid = float(ticker['bidPrice'])
-        ask = float(ticker['askPrice'])
-        return (bid + ask) / 2
-
-    def get_account_balance(self) -> dict:
+        logger.info(f"Symbol: {self.config.symbol}")
+        logger.info(f"Spread: {self.config.spread_bps} bps")
+        logger.info(f"Quote size: {self.config.quote_size}")
+        logger.info(f"Max position: {self.config.max_position}")
+
+    async def get_account_balance(self) -> dict:
         """Get account balances"""
-        account = self.client.get_account()
+        account = await self.client.get_account()
         balances = {}
         for balance in account['balances']:
             free = float(balance['free'])
@@ -192,10 +245,10 @@ class BinanceTestnetBot:
                 balances[balance['asset']] = {'free': free, 'locked': locked}
         return balances
 
-    def cancel_all_orders(self):
+    async def cancel_all_orders(self):
         """Cancel all open orders"""
         try:
-            self.client.cancel_all_open_orders(symbol=self.config.symbol)
+            await self.client.cancel_all_open_orders(symbol=self.config.symbol)
             self.bid_order_id = None
             self.ask_order_id = None
             logger.info("Cancelled all open orders")
@@ -203,14 +256,14 @@ class BinanceTestnetBot:
             if e.code != -2011:  # "Unknown order" is OK
                 logger.error(f"Error cancelling orders: {e}")
 
-    def place_order(self, side: str, price: float, quantity: float) -> Optional[int]:
+    async def place_order(self, side: str, price: float, quantity: float) -> Optional[int]:
         """Place a limit order"""
         try:
-            # Round price and quantity to proper decimals
-            price_str = f"{price:.{self.config.price_decimals}f}"
-            qty_str = f"{quantity:.{self.config.qty_decimals}f}"
+            # Truncate price and quantity to tick/step size
+            price_str = self.strategy.fmt_price(price)
+            qty_str = self.strategy.fmt_qty(quantity)
 
-            order = self.client.create_order(
+            order = await self.client.create_order(
                 symbol=self.config.symbol,
                 side=side,
                 type="LIMIT",
@@ -227,43 +280,35 @@ class BinanceTestnetBot:
             logger.error(f"Error placing {side} order: {e}")
             return None
 
-    def check_fills(self):
-        """Check for filled orders and update position"""
-        try:
-            trades = self.client.get_my_trades(symbol=self.config.symbol, limit=10)
+    def on_execution_report(self, msg: dict):
+        """Update position from a user data stream execution report"""
+        if msg.get('x') != 'TRADE':
+            return  # NEW / CANCELED / EXPIRED etc. carry no fill
 
-            # Process recent trades (simplified - in production use WebSocket)
-            for trade in trades[-5:]:  # Last 5 trades
-                trade_id = trade['id']
-                # In production, track processed trade IDs to avoid duplicates
-                side = "BUY" if trade['isBuyer'] else "SELL"
-                qty = float(trade['qty'])
-                price = float(trade['price'])
-                # self.position.on_fill(side, qty, price)
+        side = msg['S']
+        qty = float(msg['l'])    # Last executed quantity
+        price = float(msg['L'])  # Last executed price
+        self.position.on_fill(side, qty, price)
+        logger.info(f"Filled {side} {qty:.5f} @ {price:.2f} (ID: {msg['i']})")
 
-        except BinanceAPIException as e:
-            logger.error(f"Error checking fills: {e}")
-
-    def update_quotes(self):
-        """Update bid/ask quotes"""
+    async def update_quotes(self, mid_price: float):
+        """Update bid/ask quotes around the given mid price"""
         try:
-            # Get current mid price
-            mid_price = self.get_mid_price()
-
-            # Calculate new quotes
-            bid_price, ask_price, bid_size, ask_size = self.strategy.calculate_quotes(
-                mid_price, self.position.quantity
+            # Calculate new quotes (single symbol -> 1-element arrays)
+            quotes = self.strategy.calculate_quotes(
+                np.array([mid_price]), np.array([self.position.quantity])
             )
+            bid_price, ask_price, bid_size, ask_size = (float(q[0]) for q in quotes)
 
             # Cancel existing orders
-            self.cancel_all_orders()
+            await self.cancel_all_orders()
 
             # Place new orders
             if bid_size > 0:
-                self.bid_order_id = self.place_order("BUY", bid_price, bid_size)
+                self.bid_order_id = await self.place_order("BUY", bid_price, bid_size)
 
             if ask_size > 0:
-                self.ask_order_id = self.place_order("SELL", ask_price, ask_size)
+                self.ask_order_id = await self.place_order("SELL", ask_price, ask_size)
 
             # Log status
             logger.info(
@@ -277,55 +322,97 @@ class BinanceTestnetBot:
         except Exception as e:
             logger.error(f"Error updating quotes: {e}")
 
-    def run(self):
+    async def _book_ticker_loop(self):
+        """Track the mid price from the book ticker stream"""
+        async with self.bsm.symbol_book_ticker_socket(self.config.symbol) as stream:
+            while self.running:
+                msg = await stream.recv()
+                if msg.get('e') == 'error':
+                    logger.error(f"Book ticker stream error: {msg.get('m')}")
+                    continue
+                self.mid_price = (float(msg['b']) + float(msg['a'])) / 2
+                self._tick.set()
+
+    async def _user_data_loop(self):
+        """Apply fills from the user data stream"""
+        async with self.bsm.user_socket() as stream:
+            while self.running:
+                msg = await stream.recv()
+                if msg.get('e') == 'executionReport':
+                    self.on_execution_report(msg)
+                elif msg.get('e') == 'error':
+                    logger.error(f"User data stream error: {msg.get('m')}")
+
+    async def _quote_loop(self):
+        """Requote on new ticks, at most once per min_requote_interval"""
+        while self.running:
+            await self._tick.wait()
+            self._tick.clear()
+            await self.update_quotes(self.mid_price)
+            await asyncio.sleep(self.config.min_requote_interval)
+
+    async def run(self):
         """Main trading loop"""
+        await self.connect()
         self.running = True
         logger.info("Starting trading bot...")
 
         # Print initial balances
-        balances = self.get_account_balance()
+        balances = await self.get_account_balance()
         logger.info(f"Initial balances: {balances}")
 
-        try:
-            while self.running:
-                self.update_quotes()
-                self.check_fills()
-                time.sleep(self.config.update_interval)
+        tasks = [
+            asyncio.create_task(self._book_ticker_loop()),
+            asyncio.create_task(self._user_data_loop()),
+            asyncio.create_task(self._quote_loop()),
+        ]
+        stopped = asyncio.create_task(self._stopped.wait())
 
-        except KeyboardInterrupt:
-            logger.info("Shutting down...")
+        try:
+            done, _ = await asyncio.wait(tasks + [stopped], return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task is not stopped and task.exception():
+                    logger.error(f"Stream task failed: {task.exception()}")
         finally:
-            self.cancel_all_orders()
+            logger.info("Shutting down...")
+            self.running = False
+            for task in tasks + [stopped]:
+                task.cancel()
+            await asyncio.gather(*tasks, stopped, return_exceptions=True)
+
+            await self.cancel_all_orders()
+            await self.client.close_connection()
             logger.info("Bot stopped")
 
     def stop(self):
         """Stop the trading bot"""
         self.running = False
+        self._stopped.set()
 
 
-def main():
-    # Signal handler for graceful shutdown
-    bot = None
+async def main_async(config: StrategyConfig):
+    bot = BinanceTestnetBot(config)
 
-    def signal_handler(sig, frame):
-        if bot:
-            bot.stop()
+    # Signal handlers for graceful shutdown
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGINT, bot.stop)
+    loop.add_signal_handler(signal.SIGTERM, bot.stop)
 
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
+    await bot.run()
 
+
+def main():
     # Configuration
     config = StrategyConfig(
         symbol="BTCUSDT",
         spread_bps=10,
-        quote_size=0.001,      # Very small for testnet
+        quote_size=0.001,          # Very small for testnet
         max_position=0.01,
-        update_interval=10.0   # Update every 10 seconds
+        min_requote_interval=0.5   # Debounce requotes to respect rate limits
     )
 
     try:
-        bot = BinanceTestnetBot(config)
-        bot.run()
+        asyncio.run(main_async(config))
     except ValueError as e:
         logger.error(str(e))
         print("\nTo get testnet API keys:")
@@ -7,19 +7,93 @@ Data source: https://data.binance.vision/
 
 import os
 import sys
+import asyncio
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import zipfile
-import io
+import shutil
+import mmap
+import hashlib
+import struct
+import zlib
+import tempfile
 from datetime import datetime, timedelta
 from pathlib import Path
+from typing import Optional
 import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# aiohttp is optional: without it months are fetched with requests in threads
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# isal is optional: ISA-L inflates DEFLATE entries 2-3x faster than zlib
+try:
+    from isal import isal_zlib
+except ImportError:
+    isal_zlib = None
+
+# Errors a bad archive or the destination disk can raise while extracting
+EXTRACT_ERRORS = (zipfile.BadZipFile, zlib.error, OSError)
+if isal_zlib is not None:
+    EXTRACT_ERRORS += (isal_zlib.error,)
+
+# tqdm is optional: without it each month's status is printed on its own line
+try:
+    from tqdm import tqdm
+except ImportError:
+    tqdm = None
+
+# pandas is optional: without it the converter falls back to a per-row loop
+try:
+    import numpy as np
+    import pandas as pd
+except ImportError:
+    np = pd = None
+
+# pyarrow is optional: only needed for --format parquet
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
 
 BASE_URL = "https://data.binance.vision/data/spot"
+MAX_CONCURRENT_DOWNLOADS = 8
+SPOOL_MAX_SIZE = 64 << 20  # zips larger than this spill from RAM to a temp file
+STREAM_SPOOL_MAX_SIZE = 4 << 20  # same, for zips held until conversion (--no-keep-raw)
+COPY_BUFSIZE = 1 << 20
+CONVERT_CHUNK_ROWS = 1_000_000  # rows per vectorized conversion batch
+BACKTEST_COLUMNS = ("timestamp", "bid", "ask", "bid_size", "ask_size")
+MICROS_THRESHOLD = 10**13  # timestamps with more than 13 digits are microseconds
+CONVERT_WORKERS = os.cpu_count() or 1  # processes for the conversion pass
+CONVERT_PARALLEL_MIN_BYTES = 64 << 20  # smaller inputs convert in-process
+RETRY_TOTAL = 6  # retries per request on transient failures
+RETRY_BACKOFF = 1.0  # seconds; doubles after each retry
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Per socket operation, like requests' timeout: large zips may take minutes
+DOWNLOAD_TIMEOUT = (aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=60)
+                    if aiohttp is not None else None)
+
+# One keep-alive connection pool for all requests-based downloads, retrying
+# transient errors with exponential back-off (or the server's Retry-After)
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=1,
+    pool_maxsize=16,
+    max_retries=Retry(total=RETRY_TOTAL, backoff_factor=RETRY_BACKOFF,
+                      status_forcelist=RETRY_STATUSES, respect_retry_after_header=True)
+))
 
 def download_file(url: str, output_path: Path) -> bool:
     """Download a file from URL to output path."""
     try:
-        response = requests.get(url, stream=True, timeout=30)
+        response = SESSION.get(url, stream=True, timeout=30)
         if response.status_code == 200:
             with open(output_path, 'wb') as f:
                 for chunk in response.iter_content(chunk_size=8192):
@@ -30,190 +104,725 @@ def download_file(url: str, output_path: Path) -> bool:
         print(f"Error downloading {url}: {e}")
         return False
 
-def download_and_extract_zip(url: str, output_dir: Path) -> bool:
-    """Download and extract a zip file."""
+def fetch_checksum(url: str) -> Optional[str]:
+    """SHA256 that data.binance.vision publishes next to a zip, if any."""
     try:
-        response = requests.get(url, timeout=60)
-        if response.status_code != 200:
-            return False
+        response = SESSION.get(url + ".CHECKSUM", timeout=30)
+        if response.status_code == 200:
+            return response.text.split()[0].lower()
+    except requests.RequestException:
+        pass
+    return None
 
-        with zipfile.ZipFile(io.BytesIO(response.content)) as z:
-            z.extractall(output_dir)
-        return True
+async def fetch_checksum_async(session, url: str) -> Optional[str]:
+    """fetch_checksum() over an aiohttp session."""
+    try:
+        async with session.get(url + ".CHECKSUM", timeout=aiohttp.ClientTimeout(total=30)) as response:
+            if response.status == 200:
+                return (await response.text()).split()[0].lower()
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        pass
+    return None
+
+def checksum_ok(digest: str, expected: Optional[str]) -> bool:
+    """Compare a download's SHA256 with the published one (if published)."""
+    return expected is None or digest == expected
+
+def fetch_zip(url: str, spool_max: int = SPOOL_MAX_SIZE) -> tuple:
+    """
+    Download and verify a zip file. Returns (spool, status): the rewound
+    spool and "OK", or None with "Not available" (404) or "Failed (...)".
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=spool_max)
+    try:
+        # Transient errors are retried by SESSION's adapter
+        with SESSION.get(url, stream=True, timeout=60) as response:
+            if response.status_code != 200:
+                spool.close()
+                if response.status_code == 404:
+                    return None, "Not available"
+                return None, f"Failed (HTTP {response.status_code})"
+
+            # Stream the body into a spool instead of buffering response.content
+            response.raw.decode_content = True
+            digest = hashlib.sha256()
+            for chunk in iter(lambda: response.raw.read(COPY_BUFSIZE), b""):
+                digest.update(chunk)
+                spool.write(chunk)
+
+        if not checksum_ok(digest.hexdigest(), fetch_checksum(url)):
+            spool.close()
+            return None, "Failed (checksum mismatch)"
+        spool.seek(0)
+        return spool, "OK"
     except Exception as e:
-        print(f"Error: {e}")
+        spool.close()
+        return None, f"Failed ({e})"
+
+def retry_after(response, default: float) -> float:
+    """Seconds the server asked us to wait, or default."""
+    value = response.headers.get("Retry-After", "")
+    return float(value) if value.isdigit() else default
+
+async def fetch_zip_async(session, url: str, spool_max: int = SPOOL_MAX_SIZE) -> tuple:
+    """aiohttp version of fetch_zip(), with the same retry policy as SESSION."""
+    status = "Failed"
+    delay = 0.0
+    for attempt in range(RETRY_TOTAL + 1):
+        if attempt:
+            await asyncio.sleep(delay)
+        delay = RETRY_BACKOFF * 2 ** attempt
+
+        spool = tempfile.SpooledTemporaryFile(max_size=spool_max)
+        digest = hashlib.sha256()
+        try:
+            async with session.get(url, timeout=DOWNLOAD_TIMEOUT) as response:
+                if response.status != 200:
+                    spool.close()
+                    if response.status == 404:
+                        return None, "Not available"
+                    status = f"Failed (HTTP {response.status})"
+                    if response.status not in RETRY_STATUSES:
+                        return None, status
+                    delay = retry_after(response, delay)
+                    continue
+                async for chunk in response.content.iter_chunked(COPY_BUFSIZE):
+                    digest.update(chunk)
+                    spool.write(chunk)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            spool.close()
+            status = f"Failed ({str(e) or type(e).__name__})"
+            continue
+        except OSError as e:
+            # Spool spill to disk failed (e.g. ENOSPC): retrying won't help
+            spool.close()
+            return None, f"Failed ({str(e) or type(e).__name__})"
+
+        expected = await fetch_checksum_async(session, url)
+        if not checksum_ok(digest.hexdigest(), expected):
+            spool.close()
+            return None, "Failed (checksum mismatch)"
+        spool.seek(0)
+        return spool, "OK"
+
+    return None, status
+
+def download_and_extract_zip(url: str, output_dir: Path) -> bool:
+    """Download, verify and extract a zip file."""
+    spool, _ = fetch_zip(url)
+    if spool is None:
         return False
+    with spool:
+        return extract_zip(spool, output_dir) == "OK"
+
+def extract_zip(fileobj, output_dir: Path) -> str:
+    """
+    Extract a zip file (one CSV for Binance) from a seekable file object.
+    Returns "OK" or "Failed (extract: ...)".
+    """
+    try:
+        with zipfile.ZipFile(fileobj) as z:
+            for info in z.infolist():
+                if info.is_dir():
+                    continue
+                # Unencrypted DEFLATE entries can bypass zipfile's zlib inflater
+                use_isal = (isal_zlib is not None and not info.flag_bits & 0x1 and
+                            info.compress_type == zipfile.ZIP_DEFLATED)
+                # Write to .part and rename once the CRC has been checked, so
+                # an interrupted extraction never looks like a cached CSV
+                dest = output_dir / Path(info.filename).name
+                part = dest.with_name(dest.name + ".part")
+                try:
+                    with open(part, 'wb') as dst:
+                        if use_isal:
+                            inflate_entry(fileobj, info, dst)
+                        else:
+                            with z.open(info) as src:
+                                shutil.copyfileobj(src, dst, COPY_BUFSIZE)
+                    os.replace(part, dest)
+                except BaseException:
+                    part.unlink(missing_ok=True)
+                    raise
+        return "OK"
+    except EXTRACT_ERRORS as e:
+        # Corrupt data or a full disk fails this month, not the whole run
+        return f"Failed (extract: {str(e) or type(e).__name__})"
+
+def inflate_entry(fileobj, info: zipfile.ZipInfo, dst):
+    """Inflate a DEFLATE zip entry with ISA-L, reading its raw data directly."""
+    # Local file header: 30 fixed bytes, then file name and extra field
+    fileobj.seek(info.header_offset)
+    header = fileobj.read(30)
+    if header[:4] != b"PK\x03\x04":
+        raise zipfile.BadZipFile(f"Bad local header for {info.filename}")
+    name_len, extra_len = struct.unpack("<HH", header[26:30])
+    fileobj.seek(name_len + extra_len, os.SEEK_CUR)
+
+    inflater = isal_zlib.decompressobj(-15)  # raw DEFLATE stream
+    crc = 0
+    remaining = info.compress_size
+    while remaining > 0:
+        chunk = fileobj.read(min(COPY_BUFSIZE, remaining))
+        if not chunk:
+            raise zipfile.BadZipFile(f"Truncated data for {info.filename}")
+        remaining -= len(chunk)
+        data = inflater.decompress(chunk)
+        crc = zlib.crc32(data, crc)
+        dst.write(data)
+    data = inflater.flush()
+    crc = zlib.crc32(data, crc)
+    dst.write(data)
+
+    if crc != info.CRC:
+        raise zipfile.BadZipFile(f"Bad CRC-32 for {info.filename}")
+
+class SpooledZip(zipfile.ZipFile):
+    """ZipFile that also closes the spool it reads (ZipFile leaves passed-in files open)."""
+
+    def __init__(self, spool):
+        # Set first: if ZipFile.__init__ raises, __del__ still calls close()
+        self.spool = spool
+        super().__init__(spool)
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self.spool.close()
+
+def open_zip_stream(spool) -> tuple:
+    """
+    Open a downloaded zip for streaming its entries with z.open(), without
+    extracting to disk. Returns (zip, status) like fetch_zip(); closing the
+    returned ZipFile closes the spool.
+    """
+    try:
+        return SpooledZip(spool), "OK"
+    except zipfile.BadZipFile as e:
+        spool.close()
+        return None, f"Failed (bad zip: {e})"
+
+def month_range(start_date: datetime, end_date: datetime) -> list:
+    """Year-month strings (YYYY-MM) from start_date to end_date, inclusive."""
+    count = (end_date.year - start_date.year) * 12 + end_date.month - start_date.month + 1
+
+    # The last month counts only once end_date reaches start_date's day of month
+    if (end_date.day, end_date.time()) < (start_date.day, start_date.time()):
+        count -= 1
 
-def download_klines(symbol: str, interval: str, start_date: datetime,
-                    end_date: datetime, output_dir: Path) -> list:
+    first = start_date.year * 12 + start_date.month - 1
+    return [f"{m // 12:04d}-{m % 12 + 1:02d}" for m in range(first, first + count)]
+
+def print_status(filename: str, status: str):
+    print(f"{filename}: {status}")
+
+async def fetch_month(session, sem: asyncio.Semaphore, filename: str, url: str,
+                      csv_file: Path, output_dir: Path, keep_raw: bool = True,
+                      report=print_status):
+    """
+    Download one monthly zip. Returns the extracted CSV path, or with
+    keep_raw=False an open ZipFile to stream from; None on failure.
+    Calls report(filename, status) once with the outcome.
+    """
+    # Months already extracted by a previous run are not fetched again
+    if csv_file.exists() and csv_file.stat().st_size > 0:
+        report(filename, "cached")
+        return csv_file
+
+    # Streamed zips outlive the semaphore until conversion, so keep little of
+    # each in RAM: at most STREAM_SPOOL_MAX_SIZE per month, the rest on disk
+    spool_max = SPOOL_MAX_SIZE if keep_raw else STREAM_SPOOL_MAX_SIZE
+
+    async with sem:
+        if session is None:
+            spool, status = await asyncio.to_thread(fetch_zip, url, spool_max)
+        else:
+            spool, status = await fetch_zip_async(session, url, spool_max)
+
+        # "Not available" means not published (404); "Failed" is an error
+        # that persisted through the retries
+        if spool is None:
+            report(filename, status)
+            return None
+
+        if not keep_raw:
+            source, status = open_zip_stream(spool)
+            report(filename, status)
+            return source
+
+        # Extraction is blocking, so it runs in the executor (still under
+        # the semaphore to bound spooled data)
+        with spool:
+            status = await asyncio.get_running_loop().run_in_executor(
+                None, extract_zip, spool, output_dir)
+
+    if status != "OK":
+        report(filename, status)
+        return None
+    if not csv_file.exists():
+        report(filename, "Extracted but CSV not found")
+        return None
+    report(filename, "OK")
+    return csv_file
+
+async def download_months(jobs: list, output_dir: Path, keep_raw: bool = True) -> list:
+    """
+    Download (filename, url, csv_file) jobs concurrently, at most
+    MAX_CONCURRENT_DOWNLOADS at a time. Returns the CSVs (or open ZipFiles
+    when keep_raw is False) obtained, in job order.
+    """
+    print(f"Downloading {len(jobs)} monthly files...")
+    sem = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+
+    # One progress bar for all months: successes go to its postfix, failures
+    # are written above it. Reports all run on the event loop thread.
+    bar = tqdm(total=len(jobs), unit="file") if tqdm is not None else None
+    report = print_status
+    if bar is not None:
+        def report(filename: str, status: str):
+            if status in ("OK", "cached"):
+                bar.set_postfix_str(f"{filename}: {status}", refresh=False)
+            else:
+                bar.write(f"{filename}: {status}")
+            bar.update(1)
+
+    try:
+        if aiohttp is not None:
+            async with aiohttp.ClientSession() as session:
+                results = await asyncio.gather(
+                    *(fetch_month(session, sem, *job, output_dir, keep_raw, report) for job in jobs))
+        else:
+            results = await asyncio.gather(
+                *(fetch_month(None, sem, *job, output_dir, keep_raw, report) for job in jobs))
+    finally:
+        if bar is not None:
+            bar.close()
+
+    return [source for source in results if source is not None]
+
+async def download_klines(symbol: str, interval: str, start_date: datetime,
+                          end_date: datetime, output_dir: Path, keep_raw: bool = True) -> list:
     """
     Download kline (candlestick) data.
 
     Intervals: 1s, 1m, 3m, 5m, 15m, 30m, 1h, 2h, 4h, 6h, 8h, 12h, 1d, 3d, 1w, 1mo
     """
     output_dir.mkdir(parents=True, exist_ok=True)
-    downloaded_files = []
 
-    current = start_date
-    while current <= end_date:
-        year_month = current.strftime("%Y-%m")
+    jobs = []
+    for year_month in month_range(start_date, end_date):
         filename = f"{symbol}-{interval}-{year_month}.zip"
         url = f"{BASE_URL}/monthly/klines/{symbol}/{interval}/{filename}"
+        csv_file = output_dir / f"{symbol}-{interval}-{year_month}.csv"
+        jobs.append((filename, url, csv_file))
 
-        print(f"Downloading {filename}...", end=" ")
-
-        if download_and_extract_zip(url, output_dir):
-            csv_file = output_dir / f"{symbol}-{interval}-{year_month}.csv"
-            if csv_file.exists():
-                downloaded_files.append(csv_file)
-                print("OK")
-            else:
-                print("Extracted but CSV not found")
-        else:
-            print("Not available")
-
-        # Move to next month
-        if current.month == 12:
-            current = current.replace(year=current.year + 1, month=1)
-        else:
-            current = current.replace(month=current.month + 1)
-
-    return downloaded_files
+    return await download_months(jobs, output_dir, keep_raw)
 
-def download_aggtrades(symbol: str, start_date: datetime,
-                       end_date: datetime, output_dir: Path) -> list:
+async def download_aggtrades(symbol: str, start_date: datetime,
+                             end_date: datetime, output_dir: Path, keep_raw: bool = True) -> list:
     """
     Download aggregated trades data (tick-level).
     This is the most granular data available.
     """
     output_dir.mkdir(parents=True, exist_ok=True)
-    downloaded_files = []
 
-    current = start_date
-    while current <= end_date:
-        year_month = current.strftime("%Y-%m")
+    jobs = []
+    for year_month in month_range(start_date, end_date):
         filename = f"{symbol}-aggTrades-{year_month}.zip"
         url = f"{BASE_URL}/monthly/aggTrades/{symbol}/{filename}"
+        csv_file = output_dir / f"{symbol}-aggTrades-{year_month}.csv"
+        jobs.append((filename, url, csv_file))
 
-        print(f"Downloading {filename}...", end=" ")
-
-        if download_and_extract_zip(url, output_dir):
-            csv_file = output_dir / f"{symbol}-aggTrades-{year_month}.csv"
-            if csv_file.exists():
-                downloaded_files.append(csv_file)
-                print("OK")
-            else:
-                print("Extracted but CSV not found")
-        else:
-            print("Not available")
-
-        # Move to next month
-        if current.month == 12:
-            current = current.replace(year=current.year + 1, month=1)
-        else:
-            current = current.replace(month=current.month + 1)
-
-    return downloaded_files
+    return await download_months(jobs, output_dir, keep_raw)
 
 def merge_csv_files(files: list, output_file: Path, data_type: str):
-    """Merge multiple CSV files into one."""
+    """
+    Merge monthly data into one CSV, in the given (chronological) order.
+    Entries are CSV paths or open ZipFiles from open_zip_stream().
+    """
     print(f"\nMerging {len(files)} files into {output_file}...")
 
-    with open(output_file, 'w') as outfile:
+    with open(output_file, 'wb') as outfile:
         # Write header based on data type
         if data_type == "klines":
-            outfile.write("open_time,open,high,low,close,volume,close_time,"
-                         "quote_volume,trades,taker_buy_base,taker_buy_quote,ignore\n")
+            outfile.write(b"open_time,open,high,low,close,volume,close_time,"
+                          b"quote_volume,trades,taker_buy_base,taker_buy_quote,ignore\n")
         elif data_type == "aggtrades":
-            outfile.write("agg_trade_id,price,quantity,first_trade_id,"
-                         "last_trade_id,timestamp,is_buyer_maker,is_best_match\n")
-
-        for f in sorted(files):
-            with open(f, 'r') as infile:
-                for line in infile:
-                    outfile.write(line)
+            outfile.write(b"agg_trade_id,price,quantity,first_trade_id,"
+                          b"last_trade_id,timestamp,is_buyer_maker,is_best_match\n")
+
+        # Monthly CSVs have no header row: plain byte concatenation
+        for f in files:
+            if isinstance(f, zipfile.ZipFile):
+                with f:
+                    for info in f.infolist():
+                        with f.open(info) as src:
+                            copy_zip_entry(src, outfile)
+                continue
+
+            with open(f, 'rb') as infile:
+                copy_file(infile, outfile)
+                if not ends_with_newline(infile):
+                    outfile.write(b"\n")
 
     print(f"Created {output_file} ({output_file.stat().st_size / 1024 / 1024:.1f} MB)")
 
-def convert_to_backtest_format(input_file: Path, output_file: Path, data_type: str):
+def copy_file(infile, outfile):
+    """Append a whole on-disk file; in-kernel via sendfile where available."""
+    if not hasattr(os, "sendfile"):
+        shutil.copyfileobj(infile, outfile, COPY_BUFSIZE)
+        return
+
+    src, dst = infile.fileno(), outfile.fileno()
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(src, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+    # sendfile writes at the descriptor's offset: drain buffered bytes first
+    outfile.flush()
+    offset = 0
+    remaining = os.fstat(src).st_size
+    try:
+        while remaining > 0:
+            sent = os.sendfile(dst, src, offset, remaining)
+            if sent == 0:
+                break
+            offset += sent
+            remaining -= sent
+    except OSError:
+        # e.g. filesystems without sendfile support: finish in userspace
+        infile.seek(offset)
+        shutil.copyfileobj(infile, outfile, COPY_BUFSIZE)
+
+def copy_zip_entry(src, outfile):
+    """Copy a zip entry stream, newline-terminated; entries can't cheaply seek back."""
+    last = b"\n"
+    for chunk in iter(lambda: src.read(COPY_BUFSIZE), b""):
+        outfile.write(chunk)
+        last = chunk[-1:]
+    if last != b"\n":
+        outfile.write(b"\n")
+
+def ends_with_newline(f) -> bool:
+    """True if a binary file is empty or its last byte is a newline."""
+    size = os.fstat(f.fileno()).st_size
+    if size == 0:
+        return True
+    f.seek(size - 1)
+    return f.read(1) == b"\n"
+
+def convert_to_backtest_format(input_files, output_file: Path, data_type: str,
+                               fmt: str = "csv"):
     """
     Convert Binance data to our backtester format.
     Output: timestamp,bid,ask,bid_size,ask_size
 
     For klines: Use close price as mid, simulate spread
     For aggTrades: Use actual trade prices
+
+    input_files is a CSV path or a chronological list of monthly CSV paths
+    and/or open ZipFiles, which are read in turn without merging them first.
+    fmt="parquet" writes the same five int64 columns as Snappy Parquet.
     """
     print(f"\nConverting to backtest format...")
 
-    with open(input_file, 'r') as infile, open(output_file, 'w') as outfile:
-        outfile.write("timestamp,bid,ask,bid_size,ask_size\n")
-
-        # Skip header if present
-        first_line = infile.readline()
-        if not first_line[0].isdigit():
-            pass  # It was a header, continue
-        else:
-            infile.seek(0)  # Not a header, go back
+    if isinstance(input_files, (str, Path)):
+        input_files = [input_files]
+    input_files = [f if isinstance(f, zipfile.ZipFile) else Path(f) for f in input_files]
+    on_disk = all(isinstance(f, Path) for f in input_files)
+
+    if pd is None and fmt == "csv":
+        convert_rows(input_files, output_file, data_type)
+    elif (on_disk and CONVERT_WORKERS > 1 and
+          sum(f.stat().st_size for f in input_files) >= CONVERT_PARALLEL_MIN_BYTES):
+        convert_parallel(input_files, output_file, data_type, fmt)
+    elif fmt == "parquet":
+        write_parquet(iter_backtest_batches(input_files, data_type), output_file)
+    else:
+        write_csv(iter_backtest_batches(input_files, data_type), output_file)
 
-        for line in infile:
-            parts = line.strip().split(',')
+    print(f"Created {output_file}")
 
-            if data_type == "klines":
-                # Kline format: open_time,open,high,low,close,volume,...
-                timestamp = int(parts[0])
+def iter_backtest_batches(input_files: list, data_type: str):
+    """Yield backtest columns as NumPy arrays, CONVERT_CHUNK_ROWS rows at a time."""
+    for source in input_files:
+        if isinstance(source, zipfile.ZipFile):
+            with source:
+                for info in source.infolist():
+                    with source.open(info) as src:
+                        # Skip header if present
+                        has_header = not src.peek(1)[:1].isdigit()
+                        yield from parse_backtest_batches(src, data_type, has_header)
+            continue
+
+        if os.path.getsize(source) == 0:
+            continue
+
+        # Map the file read-only: pages come in on demand straight from the page
+        # cache instead of being copied through a second userspace buffer
+        with open(source, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # Skip header if present
+            has_header = not mm[:1].isdigit()
+            yield from parse_backtest_batches(mm, data_type, has_header)
+
+def parse_backtest_batches(buf, data_type: str, has_header: bool):
+    """Parse a Binance CSV from a file-like buffer into backtest column batches."""
+    if data_type == "klines":
+        # Kline format: open_time,open,high,low,close,volume,...
+        columns = {'ts': 0, 'high': 2, 'low': 3, 'close': 4, 'volume': 5}
+        dtypes = {'ts': np.int64, 'high': np.float64, 'low': np.float64,
+                  'close': np.float64, 'volume': np.float64}
+    else:
+        # AggTrade format: agg_trade_id,price,quantity,first_id,last_id,timestamp,is_buyer,is_best
+        columns = {'price': 1, 'quantity': 2, 'ts': 5, 'is_buyer': 6}
+        dtypes = {'price': np.float64, 'quantity': np.float64, 'ts': np.int64, 'is_buyer': bool}
+
+    # usecols are positional; names must follow file column order
+    names = sorted(columns, key=columns.get)
+    reader = pd.read_csv(
+        buf,
+        header=None,
+        skiprows=1 if has_header else 0,
+        usecols=sorted(columns.values()),
+        names=names,
+        dtype=dtypes,
+        true_values=['true', 'True', 'TRUE'],
+        false_values=['false', 'False', 'FALSE'],
+        engine='c',
+        chunksize=CONVERT_CHUNK_ROWS
+    )
+
+    for df in reader:
+        timestamp = df['ts'].to_numpy()
 
-                # Normalize timestamp to milliseconds
-                # Milliseconds: 13 digits (1700000000000 = Nov 2023)
-                # Microseconds: 16 digits (1700000000000000)
-                if len(str(timestamp)) > 13:  # More than 13 digits = microseconds
-                    timestamp = timestamp // 1000
+        if data_type == "klines":
+            # Normalize microsecond timestamps (more than 13 digits) to milliseconds
+            timestamp = np.where(timestamp >= MICROS_THRESHOLD, timestamp // 1000, timestamp)
+
+            # Fixed-point (4 decimals) close as mid, spread = 10% of high-low range
+            price_int = (df['close'].to_numpy() * 10000).astype(np.int64)
+            spread = np.maximum(
+                1, ((df['high'].to_numpy() - df['low'].to_numpy()) * 10000 * 0.1).astype(np.int64))
+            half_spread = spread // 2
+
+            bid = price_int - half_spread
+            ask = price_int + half_spread
+            size = df['volume'].to_numpy().astype(np.int64)
+        else:
+            price_int = (df['price'].to_numpy() * 10000).astype(np.int64)
+            size = df['quantity'].to_numpy().astype(np.int64)
+
+            # Simulate BBO from trade direction (~1 bps spread):
+            # buyer maker -> trade at bid, seller maker -> trade at ask
+            spread = np.maximum(1, price_int // 10000)
+            is_buyer = df['is_buyer'].to_numpy()
+            bid = np.where(is_buyer, price_int, price_int - spread)
+            ask = np.where(is_buyer, price_int + spread, price_int)
+
+        yield {
+            'timestamp': timestamp,
+            'bid': bid,
+            'ask': ask,
+            'bid_size': size,
+            'ask_size': size,
+        }
+
+def write_csv(batches, output_file: Path, header: bool = True):
+    """Write backtest column batches as CSV via pandas."""
+    with open(output_file, 'w', newline='') as outfile:
+        if header:
+            outfile.write("timestamp,bid,ask,bid_size,ask_size\n")
+
+        for batch in batches:
+            pd.DataFrame(batch).to_csv(outfile, index=False, header=False)
+
+def parquet_writer(output_file: Path):
+    schema = pa.schema([(name, pa.int64()) for name in BACKTEST_COLUMNS])
+
+    # Monotone timestamps and near-unique prices gain nothing from dictionaries
+    return pq.ParquetWriter(output_file, schema, compression='snappy',
+                            use_dictionary=False, write_statistics=True)
+
+def write_parquet(batches, output_file: Path):
+    """Write backtest column batches as Parquet, one row group per batch."""
+    with parquet_writer(output_file) as writer:
+        for batch in batches:
+            writer.write_table(pa.table(batch, schema=writer.schema))
+
+class MappedRange:
+    """Read-only file-like view of mm[start:end] for the CSV parser."""
+
+    def __init__(self, mm, start: int, end: int):
+        self.mm = mm
+        self.pos = start
+        self.end = end
+
+    def read(self, size: int = -1) -> bytes:
+        stop = self.end if size < 0 else min(self.pos + size, self.end)
+        data = self.mm[self.pos:stop]
+        self.pos = stop
+        return data
+
+    def readline(self) -> bytes:
+        newline = self.mm.find(b"\n", self.pos, self.end)
+        return self.read(self.end - self.pos if newline < 0 else newline + 1 - self.pos)
+
+    def __iter__(self):
+        return iter(self.readline, b"")
+
+def split_ranges(mm, start: int, parts: int) -> list:
+    """Split mm[start:] into up to `parts` byte ranges that end on line boundaries."""
+    size = len(mm)
+    bounds = [start]
+    for i in range(1, parts):
+        cut = mm.rfind(b"\n", bounds[-1], start + (size - start) * i // parts) + 1
+        if cut > bounds[-1]:
+            bounds.append(cut)
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+def convert_range(input_file: Path, start: int, end: int, data_type: str,
+                  shard_file: Path, fmt: str) -> Path:
+    """Worker: convert one line-aligned byte range of the input into a shard."""
+    # Each worker maps the file itself; the pages are shared via the page cache
+    with open(input_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        batches = parse_backtest_batches(MappedRange(mm, start, end), data_type, False)
+        if fmt == "parquet":
+            write_parquet(batches, shard_file)
+        else:
+            write_csv(batches, shard_file, header=False)
+    return shard_file
+
+def convert_parallel(input_files: list, output_file: Path, data_type: str, fmt: str):
+    """Convert line-aligned slices of the inputs in CONVERT_WORKERS processes."""
+    total_size = sum(f.stat().st_size for f in input_files)
+
+    # Each file gets a share of the workers proportional to its size
+    tasks = []
+    for input_file in input_files:
+        size = input_file.stat().st_size
+        if size == 0:
+            continue
+        with open(input_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # Skip header if present
+            start = 0 if mm[:1].isdigit() else (mm.find(b"\n") + 1 or size)
+            parts = max(1, CONVERT_WORKERS * size // total_size)
+            tasks += [(input_file, lo, hi) for lo, hi in split_ranges(mm, start, parts) if lo < hi]
+
+    shards = [output_file.with_name(f"{output_file.name}.part{i}") for i in range(len(tasks))]
 
-                close = float(parts[4])
-                volume = float(parts[5])
+    try:
+        # By now asyncio, to_thread and tqdm threads exist: forking this
+        # multi-threaded process can deadlock, so start workers fresh
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        with ProcessPoolExecutor(max_workers=max(1, min(CONVERT_WORKERS, len(tasks))),
+                                 mp_context=multiprocessing.get_context(method)) as executor:
+            futures = [executor.submit(convert_range, input_file, lo, hi, data_type, shard, fmt)
+                       for (input_file, lo, hi), shard in zip(tasks, shards)]
+            for future in futures:
+                future.result()
+
+        # Stitch shards back together in input order
+        if fmt == "parquet":
+            with parquet_writer(output_file) as writer:
+                for shard in shards:
+                    parquet = pq.ParquetFile(shard)
+                    for i in range(parquet.num_row_groups):
+                        writer.write_table(parquet.read_row_group(i))
+        else:
+            with open(output_file, 'wb') as outfile:
+                outfile.write(b"timestamp,bid,ask,bid_size,ask_size\n")
+                for shard in shards:
+                    with open(shard, 'rb') as infile:
+                        copy_file(infile, outfile)
+    finally:
+        for shard in shards:
+            if shard.exists():
+                shard.unlink()
+
+def convert_rows(input_files: list, output_file: Path, data_type: str):
+    """convert_to_backtest_format() one row at a time (no pandas required)."""
+    # Binary mode: the CSV is pure ASCII, so skip UTF-8 decoding; int()/float()
+    # accept bytes and b"%d" formatting is cheaper than f-strings
+    with open(output_file, 'wb') as outfile:
+        outfile.write(b"timestamp,bid,ask,bid_size,ask_size\n")
+
+        for source in input_files:
+            if isinstance(source, zipfile.ZipFile):
+                with source:
+                    for info in source.infolist():
+                        with source.open(info) as infile:
+                            convert_lines(infile, outfile, data_type)
+            else:
+                with open(source, 'rb') as infile:
+                    convert_lines(infile, outfile, data_type)
+
+def convert_lines(infile, outfile, data_type: str):
+    """Convert the rows of one binary CSV stream, skipping its header if any."""
+    # Skip header if present
+    first_line = infile.readline()
+    if not first_line[:1].isdigit():
+        pass  # It was a header, continue
+    else:
+        infile.seek(0)  # Not a header, go back
 
-                # Convert to fixed-point (4 decimals)
-                # Binance prices are in quote currency (e.g., USDT)
-                price_int = int(close * 10000)
+    for line in infile:
+        parts = line.rstrip(b'\r\n').split(b',')
 
-                # Simulate spread based on volatility (high-low)
-                high = float(parts[2])
-                low = float(parts[3])
-                spread = max(1, int((high - low) * 10000 * 0.1))  # 10% of range
-                half_spread = spread // 2
+        if data_type == "klines":
+            # Kline format: open_time,open,high,low,close,volume,...
+            timestamp = int(parts[0])
 
-                bid = price_int - half_spread
-                ask = price_int + half_spread
-                size = int(volume)
+            # Normalize timestamp to milliseconds
+            # Milliseconds: 13 digits (1700000000000 = Nov 2023)
+            # Microseconds: 16 digits (1700000000000000)
+            # Checked per row: merged files span the 2025 switch to microseconds
+            if timestamp >= MICROS_THRESHOLD:  # More than 13 digits = microseconds
+                timestamp = timestamp // 1000
 
-                outfile.write(f"{timestamp},{bid},{ask},{size},{size}\n")
+            close = float(parts[4])
+            volume = float(parts[5])
 
-            elif data_type == "aggtrades":
-                # AggTrade format: agg_trade_id,price,quantity,first_id,last_id,timestamp,is_buyer,is_best
-                timestamp = int(parts[5])
-                price = float(parts[1])
-                quantity = float(parts[2])
-                is_buyer = parts[6].lower() == 'true'
+            # Convert to fixed-point (4 decimals)
+            # Binance prices are in quote currency (e.g., USDT)
+            price_int = int(close * 10000)
 
-                price_int = int(price * 10000)
-                size = int(quantity)
+            # Simulate spread based on volatility (high-low)
+            high = float(parts[2])
+            low = float(parts[3])
+            spread = max(1, int((high - low) * 10000 * 0.1))  # 10% of range
+            half_spread = spread // 2
 
-                # Simulate BBO from trade direction
-                # If buyer maker (seller aggressor), price is at bid
-                # If seller maker (buyer aggressor), price is at ask
-                spread = max(1, price_int // 10000)  # ~1 bps spread
+            bid = price_int - half_spread
+            ask = price_int + half_spread
+            size = int(volume)
 
-                if is_buyer:
-                    bid = price_int
-                    ask = price_int + spread
-                else:
-                    bid = price_int - spread
-                    ask = price_int
+            outfile.write(b"%d,%d,%d,%d,%d\n" % (timestamp, bid, ask, size, size))
 
-                outfile.write(f"{timestamp},{bid},{ask},{size},{size}\n")
+        elif data_type == "aggtrades":
+            # AggTrade format: agg_trade_id,price,quantity,first_id,last_id,timestamp,is_buyer,is_best
+            timestamp = int(parts[5])
+            price = float(parts[1])
+            quantity = float(parts[2])
+            is_buyer = parts[6].lower() == b'true'
+
+            price_int = int(price * 10000)
+            size = int(quantity)
+
+            # Simulate BBO from trade direction
+            # If buyer maker (seller aggressor), price is at bid
+            # If seller maker (buyer aggressor), price is at ask
+            spread = max(1, price_int // 10000)  # ~1 bps spread
+
+            if is_buyer:
+                bid = price_int
+                ask = price_int + spread
+            else:
+                bid = price_int - spread
+                ask = price_int
 
-    print(f"Created {output_file}")
+            outfile.write(b"%d,%d,%d,%d,%d\n" % (timestamp, bid, ask, size, size))
 
-def main():
+async def main_async():
     parser = argparse.ArgumentParser(description="Download Binance historical data")
     parser.add_argument("--symbol", default="BTCUSDT", help="Trading pair (default: BTCUSDT)")
     parser.add_argument("--type", choices=["klines", "aggtrades"], default="klines",
@@ -221,9 +830,19 @@ def main():
     parser.add_argument("--interval", default="1m", help="Kline interval (default: 1m)")
     parser.add_argument("--years", type=int, default=2, help="Years of data (default: 2)")
     parser.add_argument("--output-dir", default="data/binance", help="Output directory")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv",
+                       help="Backtest file format (default: csv)")
+    parser.add_argument("--no-keep-raw", dest="keep_raw", action="store_false",
+                       help="Stream downloads into the converter without keeping monthly "
+                            "CSVs (zips wait in temp files until conversion)")
+    parser.add_argument("--keep-merged", action="store_true",
+                       help="Also write a merged CSV of the raw data")
 
     args = parser.parse_args()
 
+    if args.format == "parquet" and (pa is None or pd is None):
+        parser.error("--format parquet requires pandas and pyarrow")
+
     output_dir = Path(args.output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
 
@@ -237,25 +856,34 @@ def main():
     print(f"Output: {output_dir}\n")
 
     if args.type == "klines":
-        files = download_klines(args.symbol, args.interval, start_date, end_date,
-                               output_dir / "raw")
+        files = await download_klines(args.symbol, args.interval, start_date, end_date,
+                                      output_dir / "raw", args.keep_raw)
         merged_file = output_dir / f"{args.symbol}-{args.interval}-merged.csv"
     else:
-        files = download_aggtrades(args.symbol, start_date, end_date, output_dir / "raw")
+        files = await download_aggtrades(args.symbol, start_date, end_date, output_dir / "raw",
+                                         args.keep_raw)
         merged_file = output_dir / f"{args.symbol}-aggTrades-merged.csv"
 
     if files:
-        merge_csv_files(files, merged_file, args.type)
+        # The converter reads the monthly files in order; merging is opt-in
+        if args.keep_merged:
+            merge_csv_files(files, merged_file, args.type)
+            files = [merged_file]
 
-        backtest_file = output_dir / f"{args.symbol}-backtest.csv"
-        convert_to_backtest_format(merged_file, backtest_file, args.type)
+        backtest_file = output_dir / f"{args.symbol}-backtest.{args.format}"
+        convert_to_backtest_format(files, backtest_file, args.type, args.format)
 
         print(f"\n=== Done ===")
-        print(f"Raw files: {output_dir}/raw/")
-        print(f"Merged: {merged_file}")
+        if args.keep_raw:
+            print(f"Raw files: {output_dir}/raw/")
+        if args.keep_merged:
+            print(f"Merged: {merged_file}")
         print(f"Backtest format: {backtest_file}")
     else:
         print("\nNo data downloaded!")
 
+def main():
+    asyncio.run(main_async())
+
 if __name__ == "__main__":
     main()